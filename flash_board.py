@@ -19,13 +19,24 @@ License: MIT
 """
 
 import os
+import re
 import sys
 import time
 import argparse
 import subprocess
 import json
+import hashlib
+import importlib.util
+import mmap
+import io
+import contextlib
+import threading
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import Optional, Dict, List, Tuple
+from typing import Callable, Optional, Dict, List, Tuple
 
 # Try to import serial, handle gracefully if not available
 try:
@@ -35,30 +46,106 @@ try:
 except ImportError:
     SERIAL_AVAILABLE = False
 
+# orjson is optional; used for a faster firmware list parse when installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Prefer running esptool in-process; fall back to `python -m esptool` otherwise.
+# Only probe for the module here, it is imported lazily when first needed
+# (run_esptool also falls back if that import fails).
+ESPTOOL_AVAILABLE = importlib.util.find_spec("esptool") is not None
+
+# Bluetooth SPP/virtual COM ports can stall enumeration for seconds each
+# (BthModem is the device name used in the Windows SERIALCOMM registry key)
+BLUETOOTH_PORT_RE = re.compile(r'bluetooth|BTHENUM|BthModem', re.I)
+
+# esptool reports the detected chip before writing ("Chip is ..." / "Chip type: ...")
+CHIP_DETECTED_RE = re.compile(r'Chip (?:is|type:)\s*ESP32-S2', re.I)
+
+# How long a serial port scan stays valid (seconds)
+PORTS_CACHE_TTL = 1.0
+
+# Firmware files larger than this are hashed through mmap
+MMAP_HASH_THRESHOLD = 1024 * 1024
+
+# esptool idle watchdog: seconds without output before giving up, while
+# syncing with the bootloader and once erasing/writing has started
+SYNC_IDLE_TIMEOUT = 15.0
+ACTIVE_IDLE_TIMEOUT = 120.0
+ACTIVE_MARKERS = ("Writing at", "Erasing flash")
+
+# In-process esptool cannot be watched for idleness, so the sync timeout is
+# turned into a --connect-attempts count (one attempt takes about this long)
+CONNECT_ATTEMPT_SECONDS = 1.0
+
+# Number of esptool output lines kept for error reporting
+OUTPUT_TAIL_LINES = 200
+
+class _OutputTail(io.TextIOBase):
+    """Text stream that forwards complete lines to a callback and keeps only the last few.
+    
+    Writes made from inside the callback (e.g. the callback logging the line
+    while stdout is redirected here) go straight to `passthrough`.
+    """
+    
+    def __init__(self, on_line: Callable[[str], None], passthrough, maxlen: int = OUTPUT_TAIL_LINES):
+        self.lines = deque(maxlen=maxlen)
+        self._on_line = on_line
+        self._passthrough = passthrough
+        self._partial = ""
+        self._busy = False
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, s: str) -> int:
+        if self._busy:
+            return self._passthrough.write(s)
+        self._busy = True
+        try:
+            *complete, self._partial = re.split(r'\r\n|\r|\n', self._partial + s)
+            for line in complete:
+                self.add_line(line)
+        finally:
+            self._busy = False
+        return len(s)
+
+    def add_line(self, line: str):
+        if line.strip():
+            self.lines.append(line)
+            self._on_line(line)
+
+    def getvalue(self) -> str:
+        lines = list(self.lines)
+        if self._partial.strip():
+            lines.append(self._partial)
+        return "\n".join(lines)
+
 class BitFloppyFlasher:
     """Main flashing class for BitFloppy boards."""
     
-    def __init__(self, verbose: bool = False):
-        self.verbose = verbose
-        self.project_root = Path(__file__).parent
-        self.firmware_dir = self.project_root / "website" / "binaries"
-        self.firmware_list_file = self.firmware_dir / "firmware-list.json"
-        
-        # ESP32-S2 specific settings
-        self.chip_type = "esp32s2"
-        self.default_baudrate = 115200
-        self.bootloader_baudrate = 57600  # ESP32-S2 often needs lower baudrate for bootloader
-        
-        # Flash addresses for ESP32-S2
-        self.flash_addresses = {
-            "bootloader": "0x1000",
-            "partitions": "0x8000", 
-            "boot_app0": "0xE000",
-            "firmware": "0x10000"
-        }
-        
-        # ESP32-S2 bootloader mode instructions
-        self.bootloader_instructions = """
+    # esptool --before/--after values, keyed by whether a reset is wanted
+    BEFORE_RESET = {True: "default-reset", False: "no-reset"}
+    AFTER_RESET = {True: "hard-reset", False: "no-reset"}
+    
+    # ESP32-S2 specific settings
+    CHIP_TYPE = "esp32s2"
+    DEFAULT_BAUDRATE = 460800
+    FAST_BAUDRATE = 921600
+    BOOTLOADER_BAUDRATE = 57600  # ESP32-S2 often needs lower baudrate for bootloader
+    
+    # Flash addresses for ESP32-S2
+    FLASH_ADDRESSES = {
+        "bootloader": "0x1000",
+        "partitions": "0x8000", 
+        "boot_app0": "0xE000",
+        "firmware": "0x10000"
+    }
+    
+    # ESP32-S2 bootloader mode instructions
+    BOOTLOADER_INSTRUCTIONS = """
 ESP32-S2 Bootloader Mode Instructions:
 =====================================
 
@@ -85,20 +172,169 @@ Important Notes:
 - Board should have power (LED should be on)
 - Try different USB ports if connection fails
 - Close Arduino IDE, PlatformIO, or other serial monitors
-        """
+    """
+    
+    def __init__(self, verbose: bool = False, include_bluetooth: bool = False):
+        self.verbose = verbose
+        self.include_bluetooth = include_bluetooth
+        self._log_lock = threading.Lock()
+        self.project_root = Path(__file__).parent
+        self.firmware_dir = self.project_root / "website" / "binaries"
+        self.firmware_list_file = self.firmware_dir / "firmware-list.json"
+        
+        # Run esptool in-process; disabled while flashing several boards at once
+        # because stdout/stderr redirection is process-wide
+        self.use_esptool_module = ESPTOOL_AVAILABLE
+        
+        # Parsed firmware list, refreshed only when the file mtime changes
+        self._fw_cache = None
+        self._fw_cache_mtime = 0
+        self._fw_by_id = {}
+        self._recommended = None
+        
+        # Result of check_dependencies, None until first checked
+        self._deps_ok: Optional[bool] = None
+        
+        # Last serial port scan, reused for PORTS_CACHE_TTL seconds
+        self._ports_cache = None
+        self._ports_cache_ts = 0.0
 
     def log(self, message: str, level: str = "INFO"):
         """Print log message with timestamp."""
         timestamp = time.strftime("%H:%M:%S")
-        print(f"[{timestamp}] {level}: {message}")
+        with self._log_lock:
+            print(f"[{timestamp}] {level}: {message}")
 
     def log_verbose(self, message: str):
         """Print verbose log message."""
         if self.verbose:
             self.log(message, "VERBOSE")
 
+    def run_esptool(self, args: List[str], sync_timeout: float = SYNC_IDLE_TIMEOUT,
+                    on_line: Callable[[str], None] = None) -> Tuple[int, str]:
+        """Run esptool with the given arguments, returning (returncode, output).
+        
+        Output lines are streamed to the verbose log (and `on_line`) as they
+        arrive; only the last OUTPUT_TAIL_LINES lines are returned.
+        
+        When the esptool module cannot be imported (or use_esptool_module is
+        off, as in batch mode), `python -m esptool` is run under an idle
+        watchdog: it is stopped, raising subprocess.TimeoutExpired, if it goes
+        quiet for `sync_timeout` seconds before erasing/writing starts, or
+        ACTIVE_IDLE_TIMEOUT after. Otherwise esptool runs in-process to avoid
+        a new interpreter per call, and `sync_timeout` bounds the bootloader
+        sync through --connect-attempts; once connected, esptool's own
+        serial command timeouts apply.
+        """
+        def handle_line(line: str):
+            self.log_verbose(line.rstrip())
+            if on_line:
+                on_line(line)
+        
+        tail = _OutputTail(handle_line, sys.stdout)
+        
+        esptool = None
+        if self.use_esptool_module:
+            try:
+                import esptool
+            except ImportError as e:
+                # Found by find_spec but broken (e.g. a missing dependency);
+                # stop trying and run it as a separate interpreter from now on
+                self.log_verbose(f"Cannot import esptool ({e}), using python -m esptool")
+                self.use_esptool_module = False
+        
+        if esptool is None:
+            # Unbuffered, so progress lines reach the idle watchdog as they are printed
+            cmd = [sys.executable, "-u", "-m", "esptool"] + args
+            self.log_verbose(f"Running command: {' '.join(cmd)}")
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    text=True, bufsize=1)
+            
+            # Pipes cannot be polled with select() on Windows, so a reader
+            # thread feeds lines through a queue with a timed get()
+            lines = queue.Queue()
+            
+            def read_output():
+                for line in proc.stdout:
+                    lines.put(line)
+                lines.put(None)
+            
+            threading.Thread(target=read_output, daemon=True).start()
+            active = False
+            try:
+                while True:
+                    idle_timeout = ACTIVE_IDLE_TIMEOUT if active else sync_timeout
+                    try:
+                        line = lines.get(timeout=idle_timeout)
+                    except queue.Empty:
+                        proc.terminate()
+                        if active:
+                            self.log(f"esptool stopped responding for {idle_timeout:.0f}s", "ERROR")
+                        else:
+                            self.log("No response from bootloader — check GPIO0/BOOT", "ERROR")
+                        raise subprocess.TimeoutExpired(cmd, idle_timeout)
+                    if line is None:
+                        break
+                    line = line.rstrip("\n")
+                    if not active and any(marker in line for marker in ACTIVE_MARKERS):
+                        active = True
+                    tail.add_line(line)
+                returncode = proc.wait()
+            finally:
+                if proc.poll() is None:
+                    proc.kill()
+                proc.wait()
+            return returncode, tail.getvalue()
+            
+        attempts = max(1, int(sync_timeout / CONNECT_ATTEMPT_SECONDS))
+        args = ["--connect-attempts", str(attempts)] + args
+        self.log_verbose(f"Running esptool {' '.join(args)}")
+        returncode = 0
+        with contextlib.redirect_stdout(tail), contextlib.redirect_stderr(tail):
+            try:
+                esptool.main(args)
+            except SystemExit as e:
+                if isinstance(e.code, int):
+                    returncode = e.code
+                elif e.code is not None:
+                    returncode = 1
+                    print(e.code, file=sys.stderr)
+            except Exception as e:
+                returncode = 1
+                print(e, file=sys.stderr)
+        return returncode, tail.getvalue()
+
+    def _tune_latency(self, port: str):
+        """Lower the USB-serial latency timer to 1 ms on Linux (default is 16 ms)."""
+        if not sys.platform.startswith("linux"):
+            return
+            
+        name = os.path.basename(os.path.realpath(port))
+        latency_file = f"/sys/bus/usb-serial/devices/{name}/latency_timer"
+        if not os.path.exists(latency_file):
+            # Not an FTDI/CP210x-style adapter (e.g. native USB CDC on ttyACM)
+            return
+            
+        try:
+            fd = os.open(latency_file, os.O_WRONLY)
+            try:
+                os.write(fd, b"1")
+            finally:
+                os.close(fd)
+            self.log_verbose(f"Set latency_timer to 1 ms for {port}")
+        except PermissionError:
+            self.log_verbose(f"No permission to set latency_timer for {port}")
+            self.log_verbose(f"For faster flashing, run: setserial {port} low_latency")
+        except OSError as e:
+            self.log_verbose(f"Could not set latency_timer for {port}: {e}")
+
     def check_dependencies(self) -> bool:
-        """Check if required dependencies are installed."""
+        """Check if required dependencies are installed (checked once per instance)."""
+        if self._deps_ok is None:
+            self._deps_ok = self._check_dependencies()
+        return self._deps_ok
+
+    def _check_dependencies(self) -> bool:
         self.log("Checking dependencies...")
         
         # Check Python version
@@ -107,17 +343,14 @@ Important Notes:
             return False
             
         # Check esptool
-        try:
-            result = subprocess.run([sys.executable, "-m", "esptool", "--help"], 
-                                  capture_output=True, text=True, timeout=10)
-            if result.returncode == 0:
-                self.log("esptool found and working")
-            else:
-                self.log("esptool not found or not working", "ERROR")
-                return False
-        except (subprocess.TimeoutExpired, FileNotFoundError):
+        if not ESPTOOL_AVAILABLE:
             self.log("esptool not found. Install with: pip install esptool", "ERROR")
             return False
+        try:
+            from importlib.metadata import version
+            self.log(f"esptool found: {version('esptool')}")
+        except Exception:
+            self.log("esptool found")
             
         # Check pyserial
         if SERIAL_AVAILABLE:
@@ -130,18 +363,62 @@ Important Notes:
 
     def list_serial_ports(self) -> List[str]:
         """List available serial ports."""
-        if not SERIAL_AVAILABLE:
-            self.log("pyserial not available, cannot list ports", "WARNING")
-            self.log("Install pyserial with: pip install pyserial", "INFO")
-            return []
+        if self._ports_cache is not None and time.monotonic() - self._ports_cache_ts < PORTS_CACHE_TTL:
+            return list(self._ports_cache)
+            
+        # On Windows the registry lists COM ports directly, which is much
+        # faster than pyserial's per-port SetupAPI property queries
+        ports = self._list_windows_com_ports() if sys.platform == "win32" else None
+        
+        if ports is None:
+            if not SERIAL_AVAILABLE:
+                self.log("pyserial not available, cannot list ports", "WARNING")
+                self.log("Install pyserial with: pip install pyserial", "INFO")
+                return []
+                
+            ports = []
+            try:
+                for port in serial.tools.list_ports.comports():
+                    if not self.include_bluetooth and (
+                            BLUETOOTH_PORT_RE.search(port.description or "")
+                            or BLUETOOTH_PORT_RE.search(port.hwid or "")):
+                        self.log_verbose(f"Skipping Bluetooth port: {port.device} - {port.description}")
+                        continue
+                    ports.append(port.device)
+                    self.log_verbose(f"Found port: {port.device} - {port.description}")
+            except Exception as e:
+                self.log(f"Error listing ports: {e}", "WARNING")
+                return ports
+            
+        self._ports_cache = ports
+        self._ports_cache_ts = time.monotonic()
+        return list(ports)
+
+    def _list_windows_com_ports(self) -> Optional[List[str]]:
+        """List COM ports from HKLM\\HARDWARE\\DEVICEMAP\\SERIALCOMM, or None if unavailable."""
+        try:
+            import winreg
+            key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, r"HARDWARE\DEVICEMAP\SERIALCOMM")
+        except (ImportError, OSError) as e:
+            self.log_verbose(f"SERIALCOMM registry key not available: {e}")
+            return None
             
         ports = []
         try:
-            for port in serial.tools.list_ports.comports():
-                ports.append(port.device)
-                self.log_verbose(f"Found port: {port.device} - {port.description}")
-        except Exception as e:
-            self.log(f"Error listing ports: {e}", "WARNING")
+            index = 0
+            while True:
+                try:
+                    device, port, _ = winreg.EnumValue(key, index)
+                except OSError:
+                    break
+                index += 1
+                if not self.include_bluetooth and BLUETOOTH_PORT_RE.search(device):
+                    self.log_verbose(f"Skipping Bluetooth port: {port} - {device}")
+                    continue
+                ports.append(port)
+                self.log_verbose(f"Found port: {port} - {device}")
+        finally:
+            winreg.CloseKey(key)
             
         return ports
 
@@ -150,24 +427,24 @@ Important Notes:
         self.log(f"Detecting board on {port}...")
         
         try:
+            self._tune_latency(port)
+            
             # Try to connect with esptool to detect chip without resetting
-            cmd = [
-                sys.executable, "-m", "esptool", 
+            args = [
                 "--port", port,
-                "--baud", str(self.bootloader_baudrate),
+                "--baud", str(self.BOOTLOADER_BAUDRATE),
                 "--before", "no-reset",
                 "--after", "no-reset",
                 "chip_id"
             ]
             
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+            returncode, output = self.run_esptool(args, sync_timeout=10)
             
-            if result.returncode == 0:
+            if returncode == 0:
                 self.log(f"Board detected on {port}")
-                self.log_verbose(f"esptool output: {result.stdout}")
                 return True
             else:
-                self.log(f"Board not detected on {port}: {result.stderr}", "WARNING")
+                self.log(f"Board not detected on {port}: {output}", "WARNING")
                 return False
                 
         except subprocess.TimeoutExpired:
@@ -178,10 +455,21 @@ Important Notes:
             return False
 
     def load_firmware_list(self) -> Dict:
-        """Load firmware list from JSON file."""
+        """Load firmware list from JSON file (cached until the file changes)."""
         try:
-            with open(self.firmware_list_file, 'r') as f:
-                data = json.load(f)
+            mtime = self.firmware_list_file.stat().st_mtime
+            if self._fw_cache is not None and mtime == self._fw_cache_mtime:
+                return self._fw_cache
+                
+            buf = self.firmware_list_file.read_bytes()
+            data = orjson.loads(buf) if orjson else json.loads(buf)
+            firmwares = data.get('firmwares', [])
+            self._fw_cache = data
+            self._fw_cache_mtime = mtime
+            self._fw_by_id = {fw['id']: fw for fw in firmwares}
+            # Recommended firmware, or the first available one
+            self._recommended = next((fw for fw in firmwares if fw.get('recommended', False)),
+                                     firmwares[0] if firmwares else None)
             self.log(f"Loaded {len(data.get('firmwares', []))} firmware versions")
             return data
         except FileNotFoundError:
@@ -228,7 +516,7 @@ Important Notes:
         data = self.load_firmware_list()
         firmwares = data.get('firmwares', [])
         
-        firmware = next((fw for fw in firmwares if fw['id'] == firmware_id), None)
+        firmware = self._fw_by_id.get(firmware_id) if data else None
         if not firmware:
             self.log(f"Firmware {firmware_id} not found", "ERROR")
             self.log("Available firmware versions:", "INFO")
@@ -236,11 +524,14 @@ Important Notes:
                 self.log(f"  - {fw['id']} ({fw['version']})", "INFO")
             return None
             
+        paths = {file_type: self.firmware_dir / file_info['path']
+                 for file_type, file_info in firmware.get('files', {}).items()}
+        present = self._list_present_files(path.parent for path in paths.values())
+        
         files = {}
         missing_files = []
-        for file_type, file_info in firmware.get('files', {}).items():
-            file_path = self.firmware_dir / file_info['path']
-            if file_path.exists():
+        for file_type, file_path in paths.items():
+            if str(file_path) in present:
                 files[file_type] = str(file_path)
                 self.log_verbose(f"Found {file_type}: {file_path}")
             else:
@@ -252,109 +543,180 @@ Important Notes:
                 self.log(f"  - {missing}", "ERROR")
             self.log("Please ensure all firmware files are present in the binaries directory", "ERROR")
             return None
+            
+        # Verify checksums before touching the serial port
+        corrupt_files = []
+        for file_type, file_info in firmware.get('files', {}).items():
+            expected = file_info.get('sha256')
+            if not expected:
+                continue
+            try:
+                actual = self._sha256_file(files[file_type])
+            except OSError as e:
+                self.log(f"Could not read {file_type}: {e}", "ERROR")
+                return None
+            if actual.lower() != expected.lower():
+                corrupt_files.append(f"{file_type} ({files[file_type]})")
+            else:
+                self.log_verbose(f"Checksum OK for {file_type}")
+                
+        if corrupt_files:
+            self.log("Firmware files failed SHA-256 verification:", "ERROR")
+            for corrupt in corrupt_files:
+                self.log(f"  - {corrupt}", "ERROR")
+            self.log("Please download the firmware files again", "ERROR")
+            return None
                 
         return files
 
+    def _sha256_file(self, path: str) -> str:
+        """Return the hex SHA-256 digest of a file."""
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size > MMAP_HASH_THRESHOLD:
+                # Hash straight from the page cache without a userspace copy
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    return hashlib.sha256(mm).hexdigest()
+            if hasattr(hashlib, "file_digest"):
+                return hashlib.file_digest(f, "sha256").hexdigest()
+            digest = hashlib.sha256()
+            for chunk in iter(lambda: f.read(65536), b""):
+                digest.update(chunk)
+            return digest.hexdigest()
+
+    def _list_present_files(self, directories) -> set:
+        """Return the paths of regular files in the given directories.
+        
+        Firmware files usually share one directory, so a single scandir
+        replaces a stat per file.
+        """
+        present = set()
+        for directory in set(directories):
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_file():
+                            present.add(str(directory / entry.name))
+            except OSError:
+                continue
+        return present
+
     def erase_flash(self, port: str, baudrate: int = None, reset_before: bool = False, reset_after: bool = True) -> bool:
         """Erase the entire flash memory."""
         if baudrate is None:
-            baudrate = self.default_baudrate
+            baudrate = self.DEFAULT_BAUDRATE
             
         self.log(f"Erasing flash memory on {port} at {baudrate} baud...")
         
         try:
-            # Build esptool command for erase
-            before_reset = "default-reset" if reset_before else "no-reset"
-            after_reset = "hard-reset" if reset_after else "no-reset"
-            cmd = [
-                sys.executable, "-m", "esptool",
-                "--chip", self.chip_type,
+            self._tune_latency(port)
+            
+            # Build esptool arguments for erase
+            args = [
+                "--chip", self.CHIP_TYPE,
                 "--port", port,
                 "--baud", str(baudrate),
-                "--before", before_reset,
-                "--after", after_reset,
+                "--before", self.BEFORE_RESET[reset_before],
+                "--after", self.AFTER_RESET[reset_after],
                 "erase-flash"
             ]
             
-            self.log_verbose(f"Running command: {' '.join(cmd)}")
-            
             # Run esptool
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+            returncode, output = self.run_esptool(args)
             
-            if result.returncode == 0:
+            if returncode == 0:
                 self.log("Flash memory erased successfully!", "SUCCESS")
-                self.log_verbose(f"esptool output: {result.stdout}")
                 return True
             else:
-                self.log(f"Erase failed with return code {result.returncode}", "ERROR")
-                if result.stderr:
-                    self.log(f"Error output: {result.stderr}", "ERROR")
-                if result.stdout:
-                    self.log(f"Standard output: {result.stdout}", "INFO")
+                self.log(f"Erase failed with return code {returncode}", "ERROR")
+                if output:
+                    self.log(f"esptool output:\n{output}", "ERROR")
                 return False
                 
         except subprocess.TimeoutExpired:
-            self.log("Erase timed out (5 minutes)", "ERROR")
+            self.log("Erase timed out", "ERROR")
             return False
         except Exception as e:
             self.log(f"Error during erase: {e}", "ERROR")
             return False
 
     def flash_firmware(self, port: str, firmware_files: Dict[str, str], 
-                      baudrate: int = None, reset_before: bool = False, reset_after: bool = True) -> bool:
-        """Flash firmware to the board."""
+                      baudrate: int = None, reset_before: bool = False, reset_after: bool = True,
+                      show_instructions: bool = True) -> bool:
+        """Flash firmware to the board.
+        
+        With `show_instructions` off, the bootloader instructions are not
+        printed when no board answers (batch mode prints them once).
+        """
         if baudrate is None:
-            baudrate = self.default_baudrate
+            baudrate = self.DEFAULT_BAUDRATE
             
         self.log(f"Starting firmware flash on {port} at {baudrate} baud...")
         
         try:
-            # Build esptool command
-            before_reset = "default-reset" if reset_before else "no-reset"
-            after_reset = "hard-reset" if reset_after else "no-reset"
-            cmd = [
-                sys.executable, "-m", "esptool",
-                "--chip", self.chip_type,
+            self._tune_latency(port)
+            
+            # Build esptool arguments
+            args = [
+                "--chip", self.CHIP_TYPE,
                 "--port", port,
                 "--baud", str(baudrate),
-                "--before", before_reset,
-                "--after", after_reset,
+                "--before", self.BEFORE_RESET[reset_before],
+                "--after", self.AFTER_RESET[reset_after],
                 "write-flash"
             ]
             
-            # Add flash addresses and files
-            for file_type, file_path in firmware_files.items():
-                if file_type in self.flash_addresses:
-                    address = self.flash_addresses[file_type]
-                    cmd.extend([address, file_path])
-                    self.log(f"Will flash {file_type} to {address}")
-            
-            self.log_verbose(f"Running command: {' '.join(cmd)}")
+            # Add flash addresses and files in ascending address order so
+            # esptool writes the flash sequentially
+            entries = sorted(
+                ((self.FLASH_ADDRESSES[file_type], file_type, file_path)
+                 for file_type, file_path in firmware_files.items()
+                 if file_type in self.FLASH_ADDRESSES),
+                key=lambda entry: int(entry[0], 16)
+            )
+            for address, file_type, file_path in entries:
+                args.extend([address, file_path])
+                self.log(f"Will flash {file_type} to {address}")
             
             # Run esptool
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+            # Chip detection happens in the same esptool session as the write,
+            # so the bootloader handshake is only paid once
+            detected = []
+            
+            def on_line(line: str):
+                if not detected and CHIP_DETECTED_RE.search(line):
+                    detected.append(line)
+                    self.log(f"Board detected on {port}")
             
-            if result.returncode == 0:
+            returncode, output = self.run_esptool(args, on_line=on_line)
+            board_detected = bool(detected)
+            
+            if returncode == 0:
                 self.log("Firmware flashed successfully!", "SUCCESS")
-                self.log_verbose(f"esptool output: {result.stdout}")
                 return True
             else:
-                self.log(f"Flashing failed with return code {result.returncode}", "ERROR")
-                if result.stderr:
-                    self.log(f"Error output: {result.stderr}", "ERROR")
-                if result.stdout:
-                    self.log(f"Standard output: {result.stdout}", "INFO")
+                self.log(f"Flashing failed with return code {returncode}", "ERROR")
+                if output:
+                    self.log(f"esptool output:\n{output}", "ERROR")
+                if not board_detected:
+                    self.log("Board not detected or not in bootloader mode.", "WARNING")
+                    if show_instructions:
+                        print(self.BOOTLOADER_INSTRUCTIONS)
                 return False
                 
         except subprocess.TimeoutExpired:
-            self.log("Flashing timed out (5 minutes)", "ERROR")
+            self.log("Flashing timed out", "ERROR")
             return False
         except Exception as e:
             self.log(f"Error during flashing: {e}", "ERROR")
             return False
 
-    def interactive_flash(self, reset_before: bool = False, reset_after: bool = True):
+    def interactive_flash(self, reset_before: bool = False, reset_after: bool = True,
+                          baudrate: int = None):
         """Interactive flashing mode."""
+        if baudrate is None:
+            baudrate = self.DEFAULT_BAUDRATE
+            
         self.log("BitFloppy Interactive Flashing Mode")
         self.log("=" * 40)
         
@@ -402,19 +764,6 @@ Important Notes:
                     print("\nCancelled.")
                     return False
         
-        # Check if board is in bootloader mode
-        if not self.detect_board(selected_port):
-            self.log("Board not detected or not in bootloader mode.", "WARNING")
-            print(self.bootloader_instructions)
-            
-            retry = input("\nPut board in bootloader mode and press Enter to retry (or 'q' to quit): ").strip().lower()
-            if retry == 'q':
-                return False
-                
-            if not self.detect_board(selected_port):
-                self.log("Board still not detected. Please check connections and try again.", "ERROR")
-                return False
-        
         # List firmware versions
         firmwares = self.list_firmware_versions()
         if not firmwares:
@@ -450,15 +799,20 @@ Important Notes:
         print(f"  Board: {selected_firmware['board']}")
         print(f"  Version: {selected_firmware['version']}")
         print(f"  Port: {selected_port}")
-        print(f"  Baudrate: {self.default_baudrate}")
+        print(f"  Baudrate: {baudrate}")
         
         confirm = input("\nProceed with flashing? (y/N): ").strip().lower()
         if confirm != 'y':
             self.log("Flashing cancelled by user.")
             return False
             
-        # Flash the firmware
-        success = self.flash_firmware(selected_port, firmware_files, reset_before=reset_before, reset_after=reset_after)
+        # Flash the firmware (board detection is part of the same esptool session)
+        success = self.flash_firmware(selected_port, firmware_files, baudrate, reset_before, reset_after)
+        
+        if not success:
+            retry = input("\nPut board in bootloader mode and press Enter to retry (or 'q' to quit): ").strip().lower()
+            if retry != 'q':
+                success = self.flash_firmware(selected_port, firmware_files, baudrate, reset_before, reset_after)
         
         if success:
             self.log("Flashing completed successfully!")
@@ -497,28 +851,83 @@ Important Notes:
             self.log(f"Auto-selected port: {port}")
             
         # Auto-select firmware if not specified
+        firmware_id = self.select_firmware_id(firmware_id)
         if not firmware_id:
-            firmwares = self.list_firmware_versions()
-            if not firmwares:
-                return False
-            # Select recommended firmware or first available
-            selected_firmware = next((fw for fw in firmwares if fw.get('recommended', False)), firmwares[0])
-            firmware_id = selected_firmware['id']
-            self.log(f"Auto-selected firmware: {selected_firmware['version']}")
+            return False
             
         # Get firmware files
         firmware_files = self.get_firmware_files(firmware_id)
         if not firmware_files:
             return False
             
-        # Check if board is in bootloader mode
-        if not self.detect_board(port):
-            self.log("Board not detected or not in bootloader mode.", "ERROR")
-            print(self.bootloader_instructions)
+        # Flash the firmware (board detection is part of the same esptool session)
+        return self.flash_firmware(port, firmware_files, baudrate, reset_before, reset_after)
+
+    def auto_flash_ports(self, ports: List[str], firmware_id: str = None,
+                         baudrate: int = None, reset_before: bool = False, reset_after: bool = True) -> bool:
+        """Automatic flashing mode for several boards at once, one thread per port."""
+        self.log("BitFloppy Batch Flashing Mode")
+        self.log("=" * 40)
+        
+        # Check dependencies
+        if not self.check_dependencies():
             return False
             
-        # Flash the firmware
-        return self.flash_firmware(port, firmware_files, baudrate, reset_before, reset_after)
+        # Validate firmware directory
+        if not self.validate_firmware_directory():
+            return False
+            
+        if not ports:
+            self.log("No serial ports found. Please connect your boards.", "ERROR")
+            return False
+            
+        # Auto-select firmware if not specified
+        firmware_id = self.select_firmware_id(firmware_id)
+        if not firmware_id:
+            return False
+            
+        # Resolve and verify the firmware files once for all boards
+        firmware_files = self.get_firmware_files(firmware_id)
+        if not firmware_files:
+            return False
+            
+        self.log(f"Flashing {len(ports)} board(s) in parallel: {', '.join(ports)}")
+        
+        # esptool is I/O-bound on the serial link, so threads are enough here;
+        # each board gets its own esptool process to keep output separate
+        use_esptool_module = self.use_esptool_module
+        self.use_esptool_module = False
+        flash_one = partial(self.flash_firmware, firmware_files=firmware_files, baudrate=baudrate,
+                            reset_before=reset_before, reset_after=reset_after,
+                            show_instructions=False)
+        try:
+            with ThreadPoolExecutor(max_workers=len(ports)) as executor:
+                results = list(executor.map(flash_one, ports))
+        finally:
+            self.use_esptool_module = use_esptool_module
+        
+        succeeded = [port for port, ok in zip(ports, results) if ok]
+        failed = [port for port, ok in zip(ports, results) if not ok]
+        self.log(f"Batch complete: {len(succeeded)} succeeded, {len(failed)} failed")
+        for port in failed:
+            self.log(f"  - {port} failed", "ERROR")
+        if failed:
+            print(self.BOOTLOADER_INSTRUCTIONS)
+            
+        return not failed
+
+    def select_firmware_id(self, firmware_id: str = None) -> Optional[str]:
+        """Return the given firmware ID, or the recommended one if not specified."""
+        if firmware_id:
+            return firmware_id
+            
+        firmwares = self.list_firmware_versions()
+        if not firmwares:
+            return None
+        # Select recommended firmware or first available
+        selected_firmware = self._recommended
+        self.log(f"Auto-selected firmware: {selected_firmware['version']}")
+        return selected_firmware['id']
 
 def main():
     """Main entry point."""
@@ -530,11 +939,15 @@ Examples:
   python3 flash_board.py                    # Interactive mode
   python3 flash_board.py --auto             # Auto mode
   python3 flash_board.py --port /dev/ttyUSB0 --firmware lolin_s2_mini_v0.0.1
+  python3 flash_board.py --ports /dev/ttyUSB0,/dev/ttyUSB1  # Flash several boards in parallel
+  python3 flash_board.py --all-ports        # Flash every connected board in parallel
+  python3 flash_board.py --auto --fast      # Auto mode at 921600 baud
   python3 flash_board.py --list-firmware    # List available firmware
   python3 flash_board.py --list-ports       # List available ports
   python3 flash_board.py --reset-before     # Reset board before flashing
   python3 flash_board.py --no-reset-after   # Don't reset board after flashing
   python3 flash_board.py --erase --port /dev/ttyUSB0  # Erase flash memory
+  python3 flash_board.py --detect --port /dev/ttyUSB0 # Check board is in bootloader mode
         """
     )
     
@@ -542,27 +955,40 @@ Examples:
                        help="Use automatic mode (auto-detect port and firmware)")
     parser.add_argument("--port", "-p", 
                        help="Serial port to use (e.g., /dev/ttyUSB0, COM3)")
+    parser.add_argument("--ports",
+                       help="Comma-separated serial ports to flash in parallel")
+    parser.add_argument("--all-ports", action="store_true",
+                       help="Flash all detected serial ports in parallel")
     parser.add_argument("--firmware", "-f", 
                        help="Firmware ID to flash")
-    parser.add_argument("--baudrate", "-b", type=int, default=115200,
-                       help="Baudrate for flashing (default: 115200)")
+    parser.add_argument("--baudrate", "-b", type=int,
+                       default=BitFloppyFlasher.DEFAULT_BAUDRATE,
+                       help=f"Baudrate for flashing (default: {BitFloppyFlasher.DEFAULT_BAUDRATE}; "
+                            "esptool syncs at the ROM baudrate first, use 115200 if uploads fail)")
+    parser.add_argument("--fast", action="store_const", dest="baudrate",
+                       const=BitFloppyFlasher.FAST_BAUDRATE,
+                       help=f"Flash at {BitFloppyFlasher.FAST_BAUDRATE} baud")
     parser.add_argument("--list-firmware", action="store_true",
                        help="List available firmware versions")
     parser.add_argument("--list-ports", action="store_true",
                        help="List available serial ports")
+    parser.add_argument("--include-bluetooth", action="store_true",
+                       help="Include Bluetooth serial ports when listing/auto-selecting ports")
     parser.add_argument("--verbose", "-v", action="store_true",
                        help="Enable verbose output")
     parser.add_argument("--reset-before", action="store_true",
                        help="Reset board before flashing (default: no reset)")
     parser.add_argument("--erase", action="store_true",
                        help="Erase flash memory only (no flashing)")
+    parser.add_argument("--detect", action="store_true",
+                       help="Check that the board is in bootloader mode (no flashing)")
     parser.add_argument("--no-reset-after", action="store_true",
                        help="Don't reset board after flashing (default: reset after)")
     
     args = parser.parse_args()
     
     # Create flasher instance
-    flasher = BitFloppyFlasher(verbose=args.verbose)
+    flasher = BitFloppyFlasher(verbose=args.verbose, include_bluetooth=args.include_bluetooth)
     
     # Handle list commands
     if args.list_firmware:
@@ -586,6 +1012,17 @@ Examples:
     if not flasher.check_dependencies():
         return 1
     
+    # Handle detect command
+    if args.detect:
+        if not args.port:
+            flasher.log("Port required for detect operation. Use --port option.", "ERROR")
+            return 1
+        if flasher.detect_board(args.port):
+            return 0
+        flasher.log("Board not detected or not in bootloader mode.", "ERROR")
+        print(flasher.BOOTLOADER_INSTRUCTIONS)
+        return 1
+    
     # Handle erase command
     if args.erase:
         if not args.port:
@@ -597,10 +1034,16 @@ Examples:
     
     # Run flashing
     reset_after = not args.no_reset_after
-    if args.auto or (args.port and args.firmware):
+    if args.ports or args.all_ports:
+        if args.ports:
+            ports = [p.strip() for p in args.ports.split(",") if p.strip()]
+        else:
+            ports = flasher.list_serial_ports()
+        success = flasher.auto_flash_ports(ports, args.firmware, args.baudrate, args.reset_before, reset_after)
+    elif args.auto or (args.port and args.firmware):
         success = flasher.auto_flash(args.port, args.firmware, args.baudrate, args.reset_before, reset_after)
     else:
-        success = flasher.interactive_flash(args.reset_before, reset_after)
+        success = flasher.interactive_flash(args.reset_before, reset_after, args.baudrate)
     
     return 0 if success else 1
 
@@ -18,24 +18,73 @@ License: MIT
 """
 
 import os
+import re
 import sys
 import time
 import argparse
 import subprocess
 import json
+import shutil
+import configparser
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional, Dict, List, Tuple
 
+# orjson is optional; used for faster firmware list serialization when installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Cached result of the PlatformIO installation check
+CACHE_DIR = Path.home() / ".cache" / "bitfloppy"
+PIO_CACHE_FILE = CACHE_DIR / "pio.json"
+PIO_CACHE_MAX_AGE = 24 * 60 * 60  # seconds
+
+# Shared PlatformIO build cache, used unless the project or environment sets one
+PIO_BUILD_CACHE_DIR = CACHE_DIR / "pio-build-cache"
+
+# upload_speed setting and environment section headers in platformio.ini
+_UPLOAD_SPEED_RE = re.compile(r'^[ \t]*upload_speed\s*=\s*\d+', re.M)
+_ENV_HEADER_RE = re.compile(r'^\[env:[^\]]*\].*$', re.M)
+
+# Project inputs checked by the up-to-date test before building
+SOURCE_DIRS = ("src", "include", "lib")
+SOURCE_EXTENSIONS = (".c", ".cpp", ".h", ".hpp", ".ino", ".py", ".S")
+BUILD_INPUT_FILES = ("platformio.ini", "auto_firmware_version.py")
+
+# Records the `git describe --tags` output baked in as AUTO_VERSION by the last build
+VERSION_STAMP_FILE = ".bitfloppy-version"
+
+# Number of build/upload output lines kept for error reporting
+OUTPUT_TAIL_LINES = 200
+
 class BitFloppyPIOFlasher:
     """PlatformIO-based flashing class for BitFloppy boards."""
     
     def __init__(self, verbose: bool = False):
         self.verbose = verbose
+        self._last_log_sec = 0
+        self._last_log_str = ""
         self.project_root = Path(__file__).parent
         self.platformio_ini = self.project_root / "platformio.ini"
         self.build_dir = self.project_root / ".pio" / "build"
         self.firmware_dir = self.project_root / "website" / "binaries"
         
+        # PlatformIO command prefix: the console script if on PATH, which
+        # skips the extra runpy layer of `python -m platformio`
+        self._pio_path = shutil.which("platformio")
+        self._pio_cmd = [self._pio_path] if self._pio_path else [sys.executable, "-m", "platformio"]
+        
+        # Result of check_platformio, None until first checked
+        self._pio_ok: Optional[bool] = None
+        
+        # Parsed platformio.ini and its environments, set by load_project_config
+        self._pio_config = None
+        self._environments = None
+        
         # ESP32-S2 specific settings
         self.chip_type = "esp32s2"
         self.default_baudrate = 115200
@@ -51,24 +100,95 @@ class BitFloppyPIOFlasher:
 
     def log(self, message: str, level: str = "INFO"):
         """Print log message with timestamp."""
-        timestamp = time.strftime("%H:%M:%S")
-        print(f"[{timestamp}] {level}: {message}")
+        # Only re-format the timestamp when the second changes
+        now = int(time.time())
+        if now != self._last_log_sec:
+            self._last_log_sec = now
+            self._last_log_str = time.strftime("%H:%M:%S", time.localtime(now))
+        print(f"[{self._last_log_str}] {level}: {message}")
 
     def log_verbose(self, message: str):
         """Print verbose log message."""
         if self.verbose:
             self.log(message, "VERBOSE")
 
+    def run_streaming(self, cmd: List[str], timeout: int) -> Tuple[int, str]:
+        """Run a command, streaming its output in verbose mode.
+        
+        Output is handled as raw bytes; only the last OUTPUT_TAIL_LINES lines
+        are kept, and decoded, to be returned with the return code. Raises
+        subprocess.TimeoutExpired if the command is killed after `timeout` seconds.
+        """
+        tail = deque(maxlen=OUTPUT_TAIL_LINES)
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        timed_out = threading.Event()
+        
+        def kill():
+            timed_out.set()
+            proc.kill()
+        
+        out = getattr(sys.stdout, "buffer", None)
+        if self.verbose and out is not None:
+            sys.stdout.flush()
+        
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+        try:
+            for line in proc.stdout:
+                tail.append(line)
+                if self.verbose:
+                    if out is not None:
+                        out.write(line)
+                        out.flush()
+                    else:
+                        sys.stdout.write(line.decode("utf-8", errors="replace"))
+            returncode = proc.wait()
+        finally:
+            timer.cancel()
+            proc.stdout.close()
+            
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        return returncode, b"".join(tail).decode("utf-8", errors="replace")
+
     def check_platformio(self) -> bool:
-        """Check if PlatformIO is installed and working."""
+        """Check if PlatformIO is installed and working (checked once per instance)."""
+        if self._pio_ok is None:
+            self._pio_ok = self._check_platformio()
+        return self._pio_ok
+
+    def _check_platformio(self) -> bool:
         self.log("Checking PlatformIO installation...")
         
+        # The console script being on PATH is enough, unless the version is wanted
+        if self._pio_path and not self.verbose:
+            self.log(f"PlatformIO found: {self._pio_path}")
+            return True
+            
+        # Ask the package metadata first, it avoids starting a new interpreter
         try:
-            result = subprocess.run([sys.executable, "-m", "platformio", "--version"], 
+            from importlib.metadata import version as package_version
+            pio_version = package_version('platformio')
+        except Exception:
+            pio_version = None
+            
+        if pio_version is not None:
+            version = f"PlatformIO Core, version {pio_version}"
+            self.log(f"PlatformIO found: {version}")
+            return True
+            
+        # Not importable from this interpreter; reuse a recent check of the
+        # platformio console script before paying for a subprocess
+        version = self.read_pio_cache(pio_version) if self._pio_path else None
+        if version:
+            self.log(f"PlatformIO found: {version} (cached)")
+            return True
+            
+        try:
+            result = subprocess.run([*self._pio_cmd, "--version"], 
                                   capture_output=True, text=True, timeout=10)
             if result.returncode == 0:
-                self.log(f"PlatformIO found: {result.stdout.strip()}")
-                return True
+                version = result.stdout.strip()
             else:
                 self.log("PlatformIO not found or not working", "ERROR")
                 if result.stderr:
@@ -78,6 +198,47 @@ class BitFloppyPIOFlasher:
         except (subprocess.TimeoutExpired, FileNotFoundError):
             self.log("PlatformIO not found. Install with: pip install platformio", "ERROR")
             return False
+                
+        self.log(f"PlatformIO found: {version}")
+        if self._pio_path:
+            self.write_pio_cache(version, pio_version)
+        return True
+
+    def read_pio_cache(self, package_version: Optional[str]) -> Optional[str]:
+        """Return the cached PlatformIO version if still valid.
+        
+        The entry must match this interpreter, the PlatformIO command and the
+        platformio package version seen through importlib.metadata (None when
+        not importable).
+        """
+        try:
+            with open(PIO_CACHE_FILE, 'r') as f:
+                cache = json.load(f)
+            if (cache.get("python") == sys.executable
+                    and cache.get("python_mtime") == os.stat(sys.executable).st_mtime
+                    and cache.get("command") == self._pio_cmd
+                    and cache.get("package_version") == package_version
+                    and time.time() - cache.get("checked", 0) < PIO_CACHE_MAX_AGE):
+                return cache.get("version")
+        except (OSError, ValueError, AttributeError):
+            pass
+        return None
+
+    def write_pio_cache(self, version: str, package_version: Optional[str]):
+        """Remember a successful PlatformIO check for this interpreter."""
+        try:
+            PIO_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+            with open(PIO_CACHE_FILE, 'w') as f:
+                json.dump({
+                    "version": version,
+                    "package_version": package_version,
+                    "command": self._pio_cmd,
+                    "python": sys.executable,
+                    "python_mtime": os.stat(sys.executable).st_mtime,
+                    "checked": time.time()
+                }, f)
+        except OSError as e:
+            self.log_verbose(f"Could not write PlatformIO cache: {e}")
 
     def check_project_config(self) -> bool:
         """Check if PlatformIO project is properly configured."""
@@ -86,7 +247,44 @@ class BitFloppyPIOFlasher:
             return False
             
         self.log("PlatformIO project configuration found")
+        self.load_project_config()
+        self.configure_build_cache()
+        return True
+
+    def load_project_config(self) -> bool:
+        """Parse platformio.ini once and remember its environments."""
+        try:
+            config = configparser.ConfigParser(interpolation=None)
+            if not config.read(self.platformio_ini):
+                return False
+        except configparser.Error as e:
+            self.log_verbose(f"Could not parse {self.platformio_ini}: {e}")
+            return False
+            
+        self._pio_config = config
+        self._environments = [section[4:] for section in config.sections()
+                              if section.startswith("env:")]
         return True
+
+    def configure_build_cache(self):
+        """Share compiled framework objects across environments and clean builds.
+        
+        Points PlatformIO at PIO_BUILD_CACHE_DIR through PLATFORMIO_BUILD_CACHE_DIR
+        (inherited by the PlatformIO processes we start) rather than editing
+        platformio.ini, unless `build_cache_dir` is already configured.
+        """
+        if os.environ.get("PLATFORMIO_BUILD_CACHE_DIR"):
+            return
+        if self._pio_config is not None and self._pio_config.has_option("platformio", "build_cache_dir"):
+            return
+            
+        try:
+            PIO_BUILD_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            self.log_verbose(f"Could not create build cache directory: {e}")
+            return
+        os.environ["PLATFORMIO_BUILD_CACHE_DIR"] = str(PIO_BUILD_CACHE_DIR)
+        self.log_verbose(f"Using PlatformIO build cache: {PIO_BUILD_CACHE_DIR}")
     
     def install_platformio(self) -> bool:
         """Install PlatformIO."""
@@ -112,8 +310,17 @@ class BitFloppyPIOFlasher:
         """List available PlatformIO environments."""
         self.log("Listing available environments...")
         
+        # platformio.ini is the source of truth, read it directly
+        if self._environments is None:
+            self.load_project_config()
+        if self._environments is not None:
+            environments = list(self._environments)
+            self.log(f"Found {len(environments)} environments: {', '.join(environments)}")
+            return environments
+        
+        # Fall back to asking PlatformIO
         try:
-            result = subprocess.run([sys.executable, "-m", "platformio", "run", "--list-targets"], 
+            result = subprocess.run([*self._pio_cmd, "run", "--list-targets"], 
                                   capture_output=True, text=True, timeout=30)
             if result.returncode == 0:
                 # Parse environments from output
@@ -142,10 +349,14 @@ class BitFloppyPIOFlasher:
 
     def build_firmware(self, environment: str = None, clean: bool = False) -> bool:
         """Build firmware using PlatformIO."""
+        if environment and not clean and self._is_build_fresh(environment):
+            self.log(f"Firmware for {environment} is up-to-date, skipping build")
+            return True
+            
         self.log("Building firmware with PlatformIO...")
         
         try:
-            cmd = [sys.executable, "-m", "platformio", "run"]
+            cmd = [*self._pio_cmd, "run"]
             
             if environment:
                 cmd.extend(["-e", environment])
@@ -161,19 +372,22 @@ class BitFloppyPIOFlasher:
                     self.log(f"Clean failed: {result.stderr}", "WARNING")
                 
                 # Remove clean from command for build
-                cmd = [sys.executable, "-m", "platformio", "run"]
+                cmd = [*self._pio_cmd, "run"]
                 if environment:
                     cmd.extend(["-e", environment])
             
+            build_version = self._git_describe()
+            
             self.log(f"Running: {' '.join(cmd)}")
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+            returncode, output = self.run_streaming(cmd, timeout=300)
             
-            if result.returncode == 0:
+            if returncode == 0:
                 self.log("Firmware built successfully!", "SUCCESS")
-                self.log_verbose(f"Build output: {result.stdout}")
+                if environment:
+                    self._write_version_stamp(environment, build_version)
                 return True
             else:
-                self.log(f"Build failed: {result.stderr}", "ERROR")
+                self.log(f"Build failed:\n{output}", "ERROR")
                 return False
                 
         except subprocess.TimeoutExpired:
@@ -183,6 +397,62 @@ class BitFloppyPIOFlasher:
             self.log(f"Error during build: {e}", "ERROR")
             return False
 
+    def _is_build_fresh(self, environment: str) -> bool:
+        """Check if the built firmware is up-to-date with the project sources.
+        
+        The firmware must be newer than every source file and build script, and
+        must have been built at the same `git describe --tags` version that
+        auto_firmware_version.py embeds as AUTO_VERSION.
+        """
+        env_build_dir = self.build_dir / environment
+        try:
+            built_mtime = os.stat(env_build_dir / "firmware.bin").st_mtime
+            with open(env_build_dir / VERSION_STAMP_FILE, 'r') as f:
+                built_version = f.read()
+        except OSError:
+            return False
+            
+        if built_version != self._git_describe():
+            return False
+            
+        newest = 0.0
+        for name in BUILD_INPUT_FILES:
+            try:
+                newest = max(newest, os.stat(self.project_root / name).st_mtime)
+            except OSError:
+                continue
+            
+        pending = [str(self.project_root / name) for name in SOURCE_DIRS]
+        while pending:
+            try:
+                with os.scandir(pending.pop()) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif entry.name.endswith(SOURCE_EXTENSIONS):
+                            newest = max(newest, entry.stat().st_mtime)
+            except OSError:
+                continue
+                
+        return newest < built_mtime
+
+    def _git_describe(self) -> str:
+        """Return `git describe --tags` as used by auto_firmware_version.py."""
+        try:
+            result = subprocess.run(["git", "describe", "--tags"], cwd=self.project_root,
+                                    capture_output=True, text=True, timeout=10)
+            return result.stdout.strip()
+        except (OSError, subprocess.TimeoutExpired):
+            return ""
+
+    def _write_version_stamp(self, environment: str, build_version: str):
+        """Record the version a successful build embedded, for _is_build_fresh."""
+        try:
+            with open(self.build_dir / environment / VERSION_STAMP_FILE, 'w') as f:
+                f.write(build_version)
+        except OSError as e:
+            self.log_verbose(f"Could not write build version stamp: {e}")
+
     def find_built_firmware(self, environment: str = None) -> Dict[str, Path]:
         """Find built firmware files."""
         self.log("Looking for built firmware files...")
@@ -203,21 +473,29 @@ class BitFloppyPIOFlasher:
             self.log(f"Build directory not found: {build_env_dir}", "ERROR")
             return {}
         
-        # Look for firmware files
-        firmware_files = {}
+        # Look for firmware files in a single walk of the build directory
         file_patterns = {
             "firmware": "firmware.bin",
             "bootloader": "bootloader.bin", 
             "partitions": "partitions.bin",
             "boot_app0": "boot_app0.bin"
         }
+        wanted = {pattern: file_type for file_type, pattern in file_patterns.items()}
+        found = {}
+        
+        for root, _, files in os.walk(build_env_dir):
+            for name in files:
+                file_type = wanted.get(name)
+                if file_type and file_type not in found:
+                    found[file_type] = Path(root) / name
+            if len(found) == len(wanted):
+                break
         
+        firmware_files = {}
         for file_type, pattern in file_patterns.items():
-            # Search for the file in the build directory
-            found_files = list(build_env_dir.rglob(pattern))
-            if found_files:
-                firmware_files[file_type] = found_files[0]
-                self.log(f"Found {file_type}: {found_files[0]}")
+            if file_type in found:
+                firmware_files[file_type] = found[file_type]
+                self.log(f"Found {file_type}: {found[file_type]}")
             else:
                 self.log(f"Missing {file_type}: {pattern}", "WARNING")
         
@@ -233,14 +511,22 @@ class BitFloppyPIOFlasher:
             version_dir = self.firmware_dir / version / "lolin_s2_mini"
             version_dir.mkdir(parents=True, exist_ok=True)
             
-            # Copy files
-            for file_type, source_path in firmware_files.items():
+            # Copy files in parallel, recording sizes for the firmware list as we go
+            def copy_file(item):
+                file_type, source_path = item
                 dest_path = version_dir / f"{file_type}.bin"
-                dest_path.write_bytes(source_path.read_bytes())
-                self.log(f"Copied {file_type}: {dest_path}")
+                size = source_path.stat().st_size
+                shutil.copyfile(str(source_path), str(dest_path))
+                return file_type, dest_path, size
+            
+            sizes = {}
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                for file_type, dest_path, size in executor.map(copy_file, firmware_files.items()):
+                    sizes[file_type] = size
+                    self.log(f"Copied {file_type}: {dest_path}")
             
             # Update firmware list JSON
-            self.update_firmware_list(version, firmware_files)
+            self.update_firmware_list(version, firmware_files, sizes)
             
             self.log("Firmware copied to binaries directory successfully", "SUCCESS")
             return True
@@ -249,11 +535,20 @@ class BitFloppyPIOFlasher:
             self.log(f"Error copying firmware: {e}", "ERROR")
             return False
 
-    def update_firmware_list(self, version: str, firmware_files: Dict[str, Path]):
+    def update_firmware_list(self, version: str, firmware_files: Dict[str, Path],
+                             sizes: Dict[str, int] = None):
         """Update the firmware list JSON file."""
         firmware_list_file = self.firmware_dir / "firmware-list.json"
         
+        # Take all timestamps from a single clock read
+        now = time.localtime()
+        today = time.strftime("%Y-%m-%d", now)
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", now)
+        
         try:
+            if sizes is None:
+                sizes = {file_type: f.stat().st_size for file_type, f in firmware_files.items()}
+            
             # Load existing data
             if firmware_list_file.exists():
                 with open(firmware_list_file, 'r') as f:
@@ -266,9 +561,9 @@ class BitFloppyPIOFlasher:
                 "id": f"lolin_s2_mini_v{version}",
                 "version": f"v{version}",
                 "board": "Lolin S2 Mini",
-                "size": f"{sum(f.stat().st_size for f in firmware_files.values()) // 1024} KB",
-                "date": time.strftime("%Y-%m-%d"),
-                "changelog": f"Built from source on {time.strftime('%Y-%m-%d %H:%M:%S')}",
+                "size": f"{sum(sizes.values()) // 1024} KB",
+                "date": today,
+                "changelog": f"Built from source on {stamp}",
                 "category": "Lolin S2 Mini",
                 "recommended": True,
                 "baudrate": self.default_baudrate,
@@ -292,24 +587,33 @@ class BitFloppyPIOFlasher:
                 }
             }
             
-            # Remove existing entry with same version
-            data["firmwares"] = [fw for fw in data["firmwares"] if fw["version"] != f"v{version}"]
-            
-            # Add new entry
-            data["firmwares"].append(firmware_entry)
-            data["lastUpdated"] = time.strftime("%Y-%m-%d")
+            # Add new entry, replacing any existing entry with the same id
+            firmwares_by_id = {fw["id"]: fw for fw in data["firmwares"]}
+            firmwares_by_id[firmware_entry["id"]] = firmware_entry
+            data["firmwares"] = list(firmwares_by_id.values())
+            data["lastUpdated"] = today
             data["totalFirmwares"] = len(data["firmwares"])
             
             # Update categories
-            if not any(cat["name"] == "Lolin S2 Mini" for cat in data["categories"]):
+            category_names = {cat["name"] for cat in data["categories"]}
+            if "Lolin S2 Mini" not in category_names:
                 data["categories"].append({
                     "name": "Lolin S2 Mini",
                     "description": "Standard BitFloppy board"
                 })
             
-            # Write updated data
-            with open(firmware_list_file, 'w') as f:
-                json.dump(data, f, indent=2)
+            # Write updated data to a temporary file, then swap it in atomically
+            tmp_file = firmware_list_file.with_suffix(".json.tmp")
+            try:
+                if orjson:
+                    tmp_file.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+                else:
+                    with open(tmp_file, 'w') as f:
+                        json.dump(data, f, indent=2)
+                os.replace(tmp_file, firmware_list_file)
+            finally:
+                if tmp_file.exists():
+                    tmp_file.unlink()
             
             self.log(f"Updated firmware list: {firmware_list_file}")
             
@@ -323,36 +627,18 @@ class BitFloppyPIOFlasher:
             with open(self.platformio_ini, 'r') as f:
                 content = f.read()
             
-            # Check if upload_speed is already set
-            if 'upload_speed' in content:
-                # Update existing upload_speed
-                import re
-                pattern = r'upload_speed\s*=\s*\d+'
-                replacement = f'upload_speed = {baudrate}'
-                new_content = re.sub(pattern, replacement, content)
-            else:
-                # Add upload_speed to the environment section
-                lines = content.split('\n')
-                new_lines = []
-                in_env_section = False
-                for line in lines:
-                    new_lines.append(line)
-                    if line.strip().startswith('[env:') and not in_env_section:
-                        in_env_section = True
-                    elif in_env_section and line.strip().startswith('[') and not line.strip().startswith('[env:'):
-                        # End of environment section, add upload_speed before next section
-                        new_lines.insert(-1, f'upload_speed = {baudrate}')
-                        in_env_section = False
-                    elif in_env_section and line.strip() == '' and new_lines[-2].strip() != '':
-                        # Empty line in environment section, add upload_speed
-                        new_lines.insert(-1, f'upload_speed = {baudrate}')
-                        in_env_section = False
-                
-                if in_env_section:
-                    # Still in environment section, add at the end
-                    new_lines.append(f'upload_speed = {baudrate}')
-                
-                new_content = '\n'.join(new_lines)
+            # Update existing upload_speed
+            setting = f'upload_speed = {baudrate}'
+            new_content, count = _UPLOAD_SPEED_RE.subn(setting, content)
+            
+            if count == 0:
+                # Add upload_speed right after the first environment header
+                header = _ENV_HEADER_RE.search(new_content)
+                if header:
+                    pos = header.end()
+                    new_content = new_content[:pos] + f'\n{setting}' + new_content[pos:]
+                else:
+                    new_content = new_content.rstrip('\n') + f'\n{setting}\n'
             
             # Write updated content
             with open(self.platformio_ini, 'w') as f:
@@ -378,21 +664,20 @@ class BitFloppyPIOFlasher:
             self.update_upload_speed(baudrate)
         
         try:
-            cmd = [sys.executable, "-m", "platformio", "run", "--target", "upload"]
+            cmd = [*self._pio_cmd, "run", "--target", "upload"]
             cmd.extend(["--upload-port", port])
             
             if environment:
                 cmd.extend(["-e", environment])
             
             self.log_verbose(f"Running: {' '.join(cmd)}")
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+            returncode, output = self.run_streaming(cmd, timeout=300)
             
-            if result.returncode == 0:
+            if returncode == 0:
                 self.log("Firmware flashed successfully!", "SUCCESS")
-                self.log_verbose(f"Upload output: {result.stdout}")
                 return True
             else:
-                self.log(f"Flashing failed: {result.stderr}", "ERROR")
+                self.log(f"Flashing failed:\n{output}", "ERROR")
                 return False
                 
         except subprocess.TimeoutExpired:
@@ -410,7 +695,7 @@ class BitFloppyPIOFlasher:
         self.log(f"Opening serial monitor on {port} at {baudrate} baud...")
         
         try:
-            cmd = [sys.executable, "-m", "platformio", "device", "monitor"]
+            cmd = [*self._pio_cmd, "device", "monitor"]
             cmd.extend(["--port", port])
             cmd.extend(["--baud", str(baudrate)])
             
@@ -492,7 +777,7 @@ class BitFloppyPIOFlasher:
         if flash_choice == 'y':
             # List available ports
             try:
-                result = subprocess.run([sys.executable, "-m", "platformio", "device", "list"], 
+                result = subprocess.run([*self._pio_cmd, "device", "list"], 
                                       capture_output=True, text=True, timeout=10)
                 if result.returncode == 0:
                     print(f"\nAvailable ports:\n{result.stdout}")